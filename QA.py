@@ -2,6 +2,7 @@ import sqlite3
 import os
 import datetime
 import logging  # 1. Import logging
+import jieba
 from astrbot.api import logger  # Assuming this is the correct import for your logger
 
 class QASystem:
@@ -140,6 +141,87 @@ class QASystem:
             self._conn.rollback()  # Rollback any partial DDL changes if error occurs
             raise
 
+        self._setup_fts()
+
+    def _setup_fts(self):
+        """创建 FTS5 关键词索引表，用于消息到候选关键词的快速检索。
+
+        keyword_tokens 存的是关键词的 jieba 分词结果（空格分隔），
+        这样消息分词 OR 起来的 MATCH 查询就能命中所有与消息
+        至少共享一个分词的关键词。FTS5 不可用时降级为全量扫描。
+        """
+        try:
+            self._cursor.execute("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS qa_fts USING fts5(
+                group_id UNINDEXED,
+                keyword UNINDEXED,
+                keyword_tokens,
+                tokenize='unicode61'
+            );
+            """)
+            self._conn.commit()
+            self._fts_enabled = True
+        except sqlite3.OperationalError as e:
+            self.logger.warning(f"FTS5 not available, keyword search falls back to full scan: {e}")
+            self._fts_enabled = False
+            return
+
+        try:
+            # 兼容旧库：首次启用 FTS 时把已有关键词补录进索引
+            self._cursor.execute("SELECT COUNT(*) FROM qa_fts")
+            if self._cursor.fetchone()[0] == 0:
+                self._cursor.execute("""
+                SELECT DISTINCT group_identifier, keyword FROM qa_entries WHERE status = 'ACTIVE'
+                """)
+                rows = self._cursor.fetchall()
+                for row in rows:
+                    self._fts_insert(row['group_identifier'], row['keyword'])
+                if rows:
+                    self._conn.commit()
+                    self.logger.info(f"Backfilled {len(rows)} keywords into FTS index.")
+        except sqlite3.Error as e:
+            self._conn.rollback()
+            self.logger.error(f"Error backfilling FTS index: {e}")
+
+    def _fts_insert(self, group_identifier, keyword):
+        """把关键词写入 FTS 索引（正则关键词不走分词检索，跳过）"""
+        if not self._fts_enabled or keyword.startswith("re:"):
+            return
+        tokens = " ".join(jieba.cut(keyword))
+        self._cursor.execute("""
+        INSERT INTO qa_fts (group_id, keyword, keyword_tokens) VALUES (?, ?, ?)
+        """, (group_identifier, keyword, tokens))
+
+    def _fts_delete(self, group_identifier, keyword):
+        """把关键词从 FTS 索引中移除"""
+        if not self._fts_enabled:
+            return
+        self._cursor.execute("""
+        DELETE FROM qa_fts WHERE group_id = ? AND keyword = ?
+        """, (group_identifier, keyword))
+
+    def search_keywords(self, group_identifier, tokens):
+        """用 FTS5 MATCH 找出与消息分词至少共享一个分词的候选关键词。
+
+        tokens 是消息的 jieba 分词结果。返回候选关键词集合；
+        FTS 不可用或查询失败时返回 None，表示调用方需要全量扫描。
+        """
+        if not self._fts_enabled:
+            return None
+        terms = [t.replace('"', '').strip() for t in tokens]
+        terms = [t for t in terms if t]
+        if not terms:
+            return set()
+        match_query = " OR ".join(f'"{t}"' for t in terms)
+        try:
+            self._cursor.execute("""
+            SELECT keyword FROM qa_fts WHERE group_id = ? AND keyword_tokens MATCH ?
+            """, (group_identifier, match_query))
+            return {row[0] for row in self._cursor.fetchall()}
+        except sqlite3.Error as e:
+            self.logger.error(f"Error searching FTS keywords for group '{group_identifier}': {e}")
+            return None
+
     def add_qa(self, group_identifier, keyword, values, match_type='EXACT', status='ACTIVE', priority=0):
         """
         Adds a new Q&A entry.
@@ -162,16 +244,17 @@ class QASystem:
             """, (group_identifier, keyword, match_type, status, priority, current_time, current_time))
             entry_id = self._cursor.lastrowid
 
-            for i, value_item in enumerate(values):
-                value_type = value_item.get('type', 'TEXT')
-                value_content = value_item['content']
-                order_num = value_item.get('order', i)
-
-                self._cursor.execute("""
-                INSERT INTO qa_values (entry_id, value_type, value_content, order_num, created_at, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?)
-                """, (entry_id, value_type, value_content, order_num, current_time, current_time))
-
+            value_rows = [
+                (entry_id, value_item.get('type', 'TEXT'), value_item['content'],
+                 value_item.get('order', i), current_time, current_time)
+                for i, value_item in enumerate(values)
+            ]
+            self._cursor.executemany("""
+            INSERT INTO qa_values (entry_id, value_type, value_content, order_num, created_at, updated_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+            """, value_rows)
+
+            self._fts_insert(group_identifier, keyword)
             self._conn.commit()
             self.logger.info(
                 f"Added Q&A for keyword '{keyword}' in group '{group_identifier}' with entry_id {entry_id}.")
@@ -293,8 +376,11 @@ class QASystem:
             DELETE FROM qa_entries
             WHERE group_identifier = ? AND keyword = ?
             """, (group_identifier, keyword))
+            # _fts_delete 复用同一游标，会覆盖 rowcount，先把删除数记下来
+            deleted = self._cursor.rowcount
+            self._fts_delete(group_identifier, keyword)
             self._conn.commit()
-            if self._cursor.rowcount > 0:
+            if deleted > 0:
                 self.logger.info(f"Deleted Q&A for keyword '{keyword}' in group '{group_identifier}'.")
                 return "删除关键词成功"
             else:
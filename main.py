@@ -1,7 +1,12 @@
+import asyncio
+import base64
 import os
+import shutil
+import time
 from datetime import datetime
 
-from aiohttp import ClientSession
+import aiofiles
+from aiohttp import ClientSession, TCPConnector
 
 from astrbot.api.event import filter, AstrMessageEvent, MessageEventResult
 from astrbot.api.star import Context, Star, register
@@ -14,30 +19,66 @@ from astrbot.core.message.components import Image
 
 from .QA import QASystem
 
-async def download_image(url: str, save_path: str) -> str | None:
-    """下载图片并保存到本地"""
-    url = url.replace("https://", "http://")
-    try:
-        async with ClientSession() as client:
-            response = await client.get(url)
-            img_bytes = await response.read()
+import re
+import functools
+import jieba
 
-            os.makedirs(os.path.dirname(save_path), exist_ok=True)
+try:
+    import ahocorasick
+except ImportError:
+    # pyahocorasick 未安装时退化为逐关键词的子串匹配
+    ahocorasick = None
 
-            with open(save_path, "wb") as img_file:
-                img_file.write(img_bytes)
+def _build_automaton(qa: dict):
+    """为所有非正则关键词构建 Aho–Corasick 自动机。
 
-            logger.info(f"图片已保存: {save_path}")
-            return save_path
-    except Exception as e:
-        logger.error(f"图片下载并保存失败: {e}")
+    自动机对消息做一次 O(len(message)) 扫描就能找出所有字面命中的
+    关键词，代替逐关键词的子串查找。无可用关键词或 pyahocorasick
+    未安装时返回 None。
+    """
+    if ahocorasick is None:
+        return None
+    automaton = ahocorasick.Automaton()
+    added = False
+    for keyword in qa:
+        if keyword and not keyword.startswith("re:"):
+            automaton.add_word(keyword, keyword)
+            added = True
+    if not added:
         return None
+    automaton.make_automaton()
+    return automaton
 
+@functools.lru_cache(maxsize=4096)
+def _tokenize(text: str) -> frozenset[str]:
+    """jieba 分词并缓存结果。关键词是静态的，缓存命中后无需重复分词"""
+    return frozenset(jieba.cut(text))
 
-import re
-import jieba
+# 已编译的正则缓存，key 为模式串，编译失败的模式记为 None
+_RE_CACHE: dict[str, re.Pattern | None] = {}
+
+# 可能作为核心词出现在关键词里的词组，见 check_is_match 第 4 步
+# 编译成单个交替正则，一次 C 层扫描代替逐词的 in 判断
+_IMPORTANT_RE = re.compile("地图|攻略|指南|教程|帮助|说明")
 
-def check_is_match(keyword: str, message: str) -> bool:
+@functools.lru_cache(maxsize=4096)
+def _core_word_entry(keyword: str) -> tuple[str, frozenset[str]] | None:
+    """预计算关键词的核心词信息：(核心词, 去掉核心词后的字符集)
+
+    关键词是静态的，这半边每个关键词只算一次；匹配时只剩对消息侧
+    的替换和一次集合交集。不含核心词的关键词返回 None。
+    """
+    m = _IMPORTANT_RE.search(keyword)
+    if m is None:
+        return None
+    word = m.group(0)
+    return word, frozenset(keyword.replace(word, ""))
+
+def _has_cjk(text: str) -> bool:
+    """判断文本是否包含中文字符"""
+    return any("\u4e00" <= c <= "\u9fff" for c in text)
+
+def check_is_match(keyword: str, message: str, message_tokens: frozenset[str]) -> bool:
     """
     检查消息是否匹配关键词
     支持多种匹配策略：子串匹配、分词后部分匹配、正则表达式
@@ -45,6 +86,7 @@ def check_is_match(keyword: str, message: str) -> bool:
     Args:
         keyword: 关键词，可能是普通文本或正则表达式
         message: 用户消息文本
+        message_tokens: 消息的 jieba 分词结果，由调用方对每条消息计算一次
 
     Returns:
         bool: 是否匹配成功
@@ -60,20 +102,32 @@ def check_is_match(keyword: str, message: str) -> bool:
     # 2. 正则表达式匹配
     if keyword.startswith("re:"):
         pattern = keyword[3:]
-        try:
-            if re.search(pattern, message):
-                return True
-        except re.error:
-            pass
+        if pattern not in _RE_CACHE:
+            try:
+                _RE_CACHE[pattern] = re.compile(pattern)
+            except re.error:
+                _RE_CACHE[pattern] = None
+        pat = _RE_CACHE[pattern]
+        if pat is not None and pat.search(message):
+            return True
+
+    # 后续的分词/核心词路径开销较大，先做廉价排除：
+    # 消息过短不可能覆盖关键词；双方都不含中文时分词不会带来
+    # 新信息（纯 ASCII 关键词已由上面的子串匹配覆盖）
+    if len(message) < min(3, len(keyword)):
+        return False
+    if not _has_cjk(keyword) and not _has_cjk(message):
+        return False
 
     # 3. 分词后部分匹配
     # 对关键词和消息都进行分词，计算关键词分词结果在消息分词中的覆盖率
-    keyword_words = list(jieba.cut(keyword))
-    message_words = list(jieba.cut(message))
+    # 分词结果为 frozenset，成员判断是 O(1) 的哈希查找
+    keyword_words = _tokenize(keyword)
+    message_words = message_tokens
 
     # 如果关键词只有1-2个词，要求全部匹配
     if len(keyword_words) <= 2:
-        if all(word in message_words for word in keyword_words):
+        if keyword_words <= message_words:
             return True
     # 如果关键词较长，允许部分匹配（超过70%的词被匹配）
     else:
@@ -84,15 +138,13 @@ def check_is_match(keyword: str, message: str) -> bool:
 
     # 4. 处理特殊情况：检查核心词匹配
     # 对于某些词组可能包含核心词，如"地图"、"攻略"等
-    important_words = ["地图", "攻略", "指南", "教程", "帮助", "说明"]
-    for word in important_words:
-        if word in keyword and word in message:
-            keyword_without_core = keyword.replace(word, "")
-            message_without_core = message.replace(word, "")
+    core = _core_word_entry(keyword)
+    if core is not None:
+        core_word, keyword_rest_chars = core
+        if core_word in message:
             # 检查剩余部分是否有足够相似度
             # 简单计算：至少有一个字符相同
-            common_chars = set(keyword_without_core) & set(message_without_core)
-            if len(common_chars) >= 1:
+            if keyword_rest_chars & frozenset(message.replace(core_word, "")):
                 return True
 
     return False
@@ -102,10 +154,89 @@ import logging
 
 logger = logging.getLogger(__name__)
 
-async def fetch_invitation_code(url: str) -> str:
-    """从指定的 URL 获取邀请码"""
-    try:
-        async with aiohttp.ClientSession() as session:
+@register("QA", "tinker", "问答插件", "v1.0.2")
+class MyPlugin(Star):
+    def __init__(self, context: Context, config: AstrBotConfig):
+        super().__init__(context)
+        self.QASystem = QASystem("data/qa.db")
+        self.plugin_data_dir = StarTools.get_data_dir("astrbot_plugin_QA")
+        self.admins = config.get("admins", [])
+        # 每个群的问答缓存，避免每条消息都查询一次 SQLite
+        self._qa_cache: dict[str, dict] = {}
+        # 每个群的邀请码链接缓存，None 也会缓存以避免重复查库
+        self._invite_cache: dict[str, str | None] = {}
+        # 群成员角色缓存，(group_id, sender_id) -> (写入时间, role)
+        self._role_cache: dict[tuple[str, str], tuple[float, str]] = {}
+        # 共享的 HTTP 会话，复用连接池和 DNS 缓存
+        self._http: ClientSession | None = None
+        # 限制同时下载图片的数量，避免突发时打满套接字/文件句柄
+        self._dl_sem = asyncio.Semaphore(8)
+
+    async def initialize(self):
+        """可选择实现异步的插件初始化方法，当实例化该插件类之后会自动调用该方法。"""
+        # 图片都保存在插件数据目录下，启动时建好即可，无需每次下载都检查
+        os.makedirs(self.plugin_data_dir, exist_ok=True)
+        self._session()
+        # jieba 的词典是首次 cut 时才加载的，会卡首条消息几百毫秒；
+        # 提前在线程里建好词典，把开销挪到插件启动阶段
+        await asyncio.to_thread(jieba.initialize)
+
+    def _session(self) -> ClientSession:
+        """获取共享的 ClientSession，不存在或已关闭时重建"""
+        if self._http is None or self._http.closed:
+            self._http = ClientSession(
+                connector=TCPConnector(limit=32, limit_per_host=8, ttl_dns_cache=300)
+            )
+        return self._http
+
+    async def download_image(self, url: str, save_path: str) -> str | None:
+        """下载图片并保存到本地，按 64KB 分块流式写入"""
+        try:
+            async with self._dl_sem:
+                client = self._session()
+                # async with 确保响应体读完后连接立刻归还连接池，
+                # 而不是等 GC 回收时才释放
+                async with client.get(url) as response:
+                    async with aiofiles.open(save_path, "wb") as img_file:
+                        async for chunk in response.content.iter_chunked(65536):
+                            await img_file.write(chunk)
+
+            logger.info(f"图片已保存: {save_path}")
+            return save_path
+        except Exception as e:
+            logger.error(f"图片下载并保存失败: {e}")
+            return None
+
+    async def _persist_image(self, comp: Image, save_path: str) -> str | None:
+        """保存消息中的图片，优先复用组件里已有的本地数据。
+
+        OneBot 的 Image 组件 file 字段可能携带 base64 数据或平台已
+        缓存的本地路径，直接落盘即可，省掉一次外网往返；都没有时
+        才回退到按 url 下载。
+        """
+        file = getattr(comp, "file", None) or ""
+        try:
+            if file.startswith("base64://"):
+                img_bytes = base64.b64decode(file[len("base64://"):])
+                async with aiofiles.open(save_path, "wb") as img_file:
+                    await img_file.write(img_bytes)
+                logger.info(f"图片已保存: {save_path}")
+                return save_path
+            local_path = file[len("file://"):] if file.startswith("file://") else file
+            if local_path and os.path.isfile(local_path):
+                await asyncio.to_thread(shutil.copyfile, local_path, save_path)
+                logger.info(f"图片已保存: {save_path}")
+                return save_path
+        except Exception as e:
+            logger.error(f"保存本地图片数据失败: {e}")
+        if comp.url:
+            return await self.download_image(comp.url, save_path)
+        return None
+
+    async def fetch_invitation_code(self, url: str) -> str:
+        """从指定的 URL 获取邀请码"""
+        try:
+            session = self._session()
             async with session.get(url) as response:
                 if response.status != 200:
                     logger.error(f"请求邀请码 API 时返回状态码 {response.status}")
@@ -121,20 +252,47 @@ async def fetch_invitation_code(url: str) -> str:
                 except aiohttp.ClientError as e:
                     logger.error(f"解析 API 响应时出错: {e}")
                     return "获取邀请码失败，请稍后重试"
-    except Exception as e:
-        logger.error(f"邀请码 API 请求失败: {e}")
-        return "获取邀请码失败，请稍后重试"
+        except Exception as e:
+            logger.error(f"邀请码 API 请求失败: {e}")
+            return "获取邀请码失败，请稍后重试"
 
-@register("QA", "tinker", "问答插件", "v1.0.2")
-class MyPlugin(Star):
-    def __init__(self, context: Context, config: AstrBotConfig):
-        super().__init__(context)
-        self.QASystem = QASystem("data/qa.db")
-        self.plugin_data_dir = StarTools.get_data_dir("astrbot_plugin_QA")
-        self.admins = config.get("admins", [])
+    def _get_qa_cached(self, group_id: str) -> dict:
+        """获取指定群的问答缓存，包含问答数据和匹配加速结构"""
+        entry = self._qa_cache.get(group_id)
+        if entry is None:
+            qa = self.QASystem.get_qa_by_group(group_id) or {}
+            entry = {"qa": qa, "automaton": _build_automaton(qa)}
+            self._qa_cache[group_id] = entry
+        return entry
 
-    async def initialize(self):
-        """可选择实现异步的插件初始化方法，当实例化该插件类之后会自动调用该方法。"""
+    def _get_invitation_url_cached(self, group_id: str) -> str | None:
+        """获取群邀请码链接，优先走内存缓存（未设置的群缓存 None）"""
+        if group_id not in self._invite_cache:
+            self._invite_cache[group_id] = self.QASystem.get_group_invitation_url(group_id)
+        return self._invite_cache[group_id]
+
+    _ROLE_CACHE_TTL = 30  # 秒
+
+    async def _is_group_admin(self, event: AstrMessageEvent) -> bool:
+        """判断发送者是否为群主/管理员，角色结果缓存 30 秒
+
+        连续执行多条管理命令时只查询一次 OneBot 接口。
+        """
+        assert isinstance(event, AiocqhttpMessageEvent), "Event must be AiocqhttpMessageEvent"
+        group_id = event.get_group_id()
+        sender_id = event.get_sender_id()
+        key = (group_id, sender_id)
+        now = time.monotonic()
+        cached = self._role_cache.get(key)
+        if cached is not None and now - cached[0] < self._ROLE_CACHE_TTL:
+            role = cached[1]
+        else:
+            info = await event.bot.get_group_member_info(
+                group_id=int(group_id), user_id=int(sender_id), no_cache=False
+            )
+            role = info.get("role", "unknown")
+            self._role_cache[key] = (now, role)
+        return role in ("owner", "admin")
 
     @filter.command("增加关键词", alias={ '添加关键词' })
     async def add_keyword(self, event: AstrMessageEvent, keyword: str):
@@ -143,24 +301,7 @@ class MyPlugin(Star):
             yield event.plain_result("私聊模式下不支持添加关键词")
             return
         sender_id = event.get_sender_id()
-        assert isinstance(event, AiocqhttpMessageEvent), "Event must be AiocqhttpMessageEvent"
-        bot = event.bot
-        info = await event.bot.get_group_member_info(
-            group_id=int(event.get_group_id()), user_id=int(sender_id), no_cache=True
-        )
-        role = info.get("role", "unknown")
-        ok = False
-        match role:
-            case "owner":
-                ok = True
-            case "admin":
-                ok = True
-            case "member":
-                ok = False
-            case _:
-                ok = False
-
-        if sender_id not in self.admins or not ok:
+        if sender_id not in self.admins or not await self._is_group_admin(event):
             yield event.plain_result("你没有权限添加关键词")
             return
         try:
@@ -180,12 +321,11 @@ class MyPlugin(Star):
                     for comp in message_obj.message:
                         if isinstance(comp, Image):
                             # 保存图片到本地，并且保存
-                            reply_img = comp.url
                             temp_path = os.path.join(
                                 self.plugin_data_dir,
                                 f"reply_image_{group_id}_{keyword}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jpg"
                             )
-                            image_path = await download_image(reply_img, temp_path)
+                            image_path = await self._persist_image(comp, temp_path)
                 reply_text = event.message_str
                 values_list = []
                 if reply_text:
@@ -194,6 +334,7 @@ class MyPlugin(Star):
                     values_list.append({ 'type': 'IMAGE_URL', 'content': image_path })
                 if values_list:
                     self.QASystem.add_qa(group_id, keyword, values=values_list)
+                    self._qa_cache.pop(group_id, None)
                 controller.stop()
             try:
                 await wait_for_keyword_reply(event)
@@ -212,31 +353,13 @@ class MyPlugin(Star):
             yield event.plain_result("私聊模式下不支持删除关键词")
             return
         sender_id = event.get_sender_id()
-        assert isinstance(event, AiocqhttpMessageEvent), "Event must be AiocqhttpMessageEvent"
-        bot = event.bot
-        info = await event.bot.get_group_member_info(
-            group_id=int(event.get_group_id()), user_id=int(sender_id), no_cache=True
-        )
-        role = info.get("role", "unknown")
-        ok = False
-        match role:
-            case "owner":
-                ok = True
-            case "admin":
-                ok = True
-            case "member":
-                ok = False
-            case _:
-                ok = False
-        if sender_id not in self.admins or not ok:
-            yield event.plain_result("你没有权限添加关键词")
-            return
-        if sender_id not in self.admins:
+        if sender_id not in self.admins or not await self._is_group_admin(event):
             yield event.plain_result("你没有权限删除关键词")
             return
         try:
             group_id = event.get_group_id()
             result = self.QASystem.delete_qa(group_id, keyword)
+            self._qa_cache.pop(group_id, None)
             yield event.plain_result(result)
         except Exception as e:
             logger.error(f"删除关键词失败: {e}")
@@ -249,13 +372,8 @@ class MyPlugin(Star):
             yield event.plain_result("私聊模式下不支持设置邀请码链接")
             return
         sender_id = event.get_sender_id()
-        assert isinstance(event, AiocqhttpMessageEvent), "Event must be AiocqhttpMessageEvent"
         group_id = event.get_group_id()
-        info = await event.bot.get_group_member_info(
-            group_id=int(group_id), user_id=int(sender_id), no_cache=True
-        )
-        role = info.get("role", "unknown")
-        if sender_id not in self.admins and role not in ["owner", "admin"]:
+        if sender_id not in self.admins and not await self._is_group_admin(event):
             yield event.plain_result("你没有权限设置邀请码链接")
             return
         if not url.startswith("http"):
@@ -263,64 +381,94 @@ class MyPlugin(Star):
             return
         success = self.QASystem.add_group_invitation_url(group_id, url)
         if success:
+            self._invite_cache.pop(group_id, None)
             yield event.plain_result("邀请码链接设置成功")
         else:
             yield event.plain_result("邀请码链接设置失败")
 
-@filter.command("查询关键词")
-async def query_keyword(self, event: AstrMessageEvent):
-    """查询当前群组的所有关键词"""
-    if event.is_private_chat():
-        yield event.plain_result("私聊模式下不支持查询关键词")
-        return
-    try:
-        group_id = event.get_group_id()
-        result = self.QASystem.get_qa_by_group(group_id)
-        if not result:
-            yield event.plain_result("当前群组没有设置任何关键词")
+    @filter.command("查询关键词")
+    async def query_keyword(self, event: AstrMessageEvent):
+        """查询当前群组的所有关键词"""
+        if event.is_private_chat():
+            yield event.plain_result("私聊模式下不支持查询关键词")
             return
-        message = "当前群组的关键词及其回复如下：\n"
-        for keyword, replies in result.items():
-            message += f"关键词: {keyword}\n"
-            for i, item in enumerate(replies):
-                message += f"  回复{i + 1}: {item['content']}\n"
-        yield event.plain_result(message)
-    except Exception as e:
-        logger.error(f"查询关键词失败: {e}")
-        yield event.plain_result("查询关键词失败")
-
-@filter.event_message_type(filter.EventMessageType.ALL)
-async def on_all_message(self, event: AstrMessageEvent):
-    """接收所有消息事件"""
-    # logger.info(event.message_obj)
-    if event.is_private_chat():
-        return
-    message = event.message_str
-    if message.startswith('/'):
-        # 忽略以斜杠开头的命令消息
-        logger.info(f"Ignoring command message: {message}")
-        return
-    group_id = event.get_group_id()
-    result = self.QASystem.get_qa_by_group(group_id)
-    for keyword in result:
-        if check_is_match(keyword, message):
-            reply = result[keyword]
-            if isinstance(reply, list):
-                for item in reply:
-                    if item['type'] == 'TEXT':
-                        yield event.plain_result(item['content'])
-                    if item['type'] == 'IMAGE_URL':
-                        yield event.image_result(item['content'])
-    
-    # 只有当用户输入“邀请码”时才触发获取邀请码的操作
-    if message.strip() == "邀请码":
-        url = self.QASystem.get_group_invitation_url(group_id)
-        if not url:
-            yield event.plain_result("当前群未设置邀请码链接")
+        try:
+            group_id = event.get_group_id()
+            result = self.QASystem.get_qa_by_group(group_id)
+            if not result:
+                yield event.plain_result("当前群组没有设置任何关键词")
+                return
+            message = "当前群组的关键词及其回复如下：\n"
+            for keyword, replies in result.items():
+                message += f"关键词: {keyword}\n"
+                for i, item in enumerate(replies):
+                    message += f"  回复{i + 1}: {item['content']}\n"
+            yield event.plain_result(message)
+        except Exception as e:
+            logger.error(f"查询关键词失败: {e}")
+            yield event.plain_result("查询关键词失败")
+
+    @filter.event_message_type(filter.EventMessageType.ALL)
+    async def on_all_message(self, event: AstrMessageEvent):
+        """接收所有消息事件"""
+        # logger.info(event.message_obj)
+        if event.is_private_chat():
             return
-        code = await fetch_invitation_code(url)
-        yield event.plain_result(code)
+        message = event.message_str
+        if message.startswith('/'):
+            # 忽略以斜杠开头的命令消息
+            logger.info(f"Ignoring command message: {message}")
+            return
+        group_id = event.get_group_id()
+        entry = self._get_qa_cached(group_id)
+        result = entry["qa"]
+        # 没有关键词也没有邀请码链接的群，直接跳过整个匹配流程
+        if not result and not self._get_invitation_url_cached(group_id):
+            return
+        # 整条消息只分词一次，候选检索和逐关键词匹配共用同一份结果
+        message_tokens = frozenset(jieba.cut(message))
+        # 先用 FTS5 检索出与消息至少共享一个分词的候选关键词，
+        # 其余关键词只保留廉价的子串检查，不再走 jieba 模糊匹配
+        candidates = self.QASystem.search_keywords(group_id, message_tokens) if result else None
+        # Aho–Corasick 自动机一次扫描找出所有字面命中的关键词
+        automaton = entry["automaton"]
+        literal_hits = (
+            {found for _, found in automaton.iter(message)} if automaton is not None else None
+        )
+        for keyword in result:
+            if literal_hits is not None and keyword in literal_hits:
+                matched = True
+            else:
+                # 自动机不可用时保留逐关键词的子串检查兜底
+                in_message = keyword in message if literal_hits is None else False
+                if (
+                    candidates is not None
+                    and keyword not in candidates
+                    and not keyword.startswith("re:")
+                    and not in_message
+                ):
+                    continue
+                matched = check_is_match(keyword, message, message_tokens)
+            if matched:
+                reply = result[keyword]
+                if isinstance(reply, list):
+                    for item in reply:
+                        if item['type'] == 'TEXT':
+                            yield event.plain_result(item['content'])
+                        if item['type'] == 'IMAGE_URL':
+                            yield event.image_result(item['content'])
+
+        # 只有当用户输入“邀请码”时才触发获取邀请码的操作
+        if message.strip() == "邀请码":
+            url = self._get_invitation_url_cached(group_id)
+            if not url:
+                yield event.plain_result("当前群未设置邀请码链接")
+                return
+            code = await self.fetch_invitation_code(url)
+            yield event.plain_result(code)
 
     async def terminate(self):
         """可选择实现异步的插件销毁方法，当插件被卸载/停用时会调用。"""
+        if self._http is not None and not self._http.closed:
+            await self._http.close()
         self.QASystem.close()